@@ -2,10 +2,19 @@ import os
 import random
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from math import ceil, log
 
 DAMPING = 0.85
 SAMPLES = 10000
-THRESHOLD = 0.001
+TOLERANCE = 1e-6
+EXTRAPOLATE_EVERY = 5
+RATIO_TOLERANCE = 0.05
+MAX_ITERATIONS = 100
+CRAWL_WORKERS = 16
+
+LINK_PATTERN = re.compile(r"<a\s[^>]*?href=\"([^\"]*)\"")
 
 
 def main():
@@ -16,7 +25,10 @@ def main():
     print(f"PageRank Results from Sampling (n = {SAMPLES})")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
-    ranks = iterate_pagerank(corpus, DAMPING)
+    try:
+        ranks = iterate_pagerank(corpus, DAMPING)
+    except RuntimeError as e:
+        sys.exit(str(e))
     print(f"PageRank Results from Iteration")
     for page in sorted(ranks):
         print(f"  {page}: {ranks[page]:.4f}")
@@ -28,27 +40,37 @@ def crawl(directory):
     Return a dictionary where each key is a page, and values are
     a list of all other pages in the corpus that are linked to by the page.
     """
-    pages = dict()
-
-    # Extract all links from HTML files
-    for filename in os.listdir(directory):
-        if not filename.endswith(".html"):
-            continue
-        with open(os.path.join(directory, filename)) as f:
-            contents = f.read()
-            links = re.findall(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"", contents)
-            pages[filename] = set(links) - {filename}
+    filenames = [
+        filename for filename in sorted(os.listdir(directory))
+        if filename.endswith(".html")
+    ]
+
+    # Extract all links from HTML files, overlapping the file reads
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        results = executor.map(extract_links, paths)
+        pages = {
+            filename: links - {filename}
+            for filename, links in zip(filenames, results)
+        }
 
     # Only include links to other pages in the corpus
-    for filename in pages:
-        pages[filename] = set(
-            link for link in pages[filename]
-            if link in pages
-        )
+    corpus_pages = pages.keys()
+    for filename, links in pages.items():
+        pages[filename] = links & corpus_pages
 
     return pages
 
 
+def extract_links(path):
+    """
+    Read the HTML page at `path` and return the set of all link
+    targets found in its anchor tags.
+    """
+    with open(path) as f:
+        return set(LINK_PATTERN.findall(f.read()))
+
+
 def transition_model(corpus, page, damping_factor):
     """
     Return a probability distribution over which page to visit next,
@@ -58,29 +80,17 @@ def transition_model(corpus, page, damping_factor):
     linked to by `page`. With probability `1 - damping_factor`, choose
     a link at random chosen from all pages in the corpus.
     """
-    prob_dist = {}
-
+    N = len(corpus)
     links = corpus[page]
-    num_links = len(links)
-    if num_links != 0:
-
-        prob_damp = (1 - damping_factor) / len(corpus)
 
-        for html in corpus:
+    if not links:
+        prob = 1 / N
+        return {html: prob for html in corpus}
 
-            if html in links:
+    prob_damp = (1 - damping_factor) / N
+    prob_link = damping_factor / len(links) + prob_damp
 
-                prob_link = damping_factor / num_links
-                prob_dist[html] = prob_link + prob_damp
-
-            else:
-                prob_dist[html] = prob_damp
-
-    else:
-        for html in corpus:
-            prob_dist[html] = 1 / len(corpus)
-
-    return prob_dist
+    return {html: prob_link if html in links else prob_damp for html in corpus}
 
 
 def sample_pagerank(corpus, damping_factor, n):
@@ -92,22 +102,68 @@ def sample_pagerank(corpus, damping_factor, n):
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
     """
-    rank = {}
-    for html in corpus:
-        rank[html] = 0
+    N = len(corpus)
+    nodes = list(corpus)
+
+    # Evaluate the transition model once per page and keep it as an
+    # alias table, since corpus and damping never change
+    probs = []
+    aliases = []
+    for html in nodes:
+        model = transition_model(corpus, html, damping_factor)
+        prob, alias = alias_table([model[page] for page in nodes])
+        probs.append(prob)
+        aliases.append(alias)
 
-    next_page = random.choice(list(corpus))
-    rank[next_page] += 1
+    counts = [0] * N
 
+    current = random.randrange(N)
+    counts[current] += 1
+
+    # One uniform draw picks both the column and the biased coin flip
+    rand = random.random
     for i in range(n - 1):
-        prob_dist = transition_model(corpus, next_page, DAMPING)
-        next_page = random.choices(list(prob_dist.keys()), weights=list(prob_dist.values()))[0]
-        rank[next_page] += 1
+        u = rand() * N
+        column = int(u)
+        current = column if u - column < probs[current][column] else aliases[current][column]
+        counts[current] += 1
+
+    return {html: count / n for html, count in zip(nodes, counts)}
 
-    for page in rank:
-        rank[page] = rank[page] / n
 
-    return rank
+def alias_table(weights):
+    """
+    Build a Vose alias table for sampling from the discrete distribution
+    `weights`, which should sum to 1.
+
+    Return a pair of lists `(prob, alias)`: to sample, pick a column `i`
+    uniformly at random, then keep `i` with probability `prob[i]` and
+    otherwise take `alias[i]`.
+    """
+    n = len(weights)
+    prob = [0.0] * n
+    alias = list(range(n))
+
+    scaled = [w * n for w in weights]
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1 - scaled[less]
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # Whatever is left is 1 up to rounding error
+    for i in small + large:
+        prob[i] = 1.0
+
+    return prob, alias
 
 
 def iterate_pagerank(corpus, damping_factor):
@@ -120,39 +176,155 @@ def iterate_pagerank(corpus, damping_factor):
     PageRank values should sum to 1.
     """
     N = len(corpus)
+    nodes = list(corpus)
+    idx = {html: i for i, html in enumerate(nodes)}
 
-    rank = {}
-    new = {}
-    link_to = {}
+    # Count the links into every page
+    in_degree = [0] * N
+    for html in nodes:
+        for link in corpus[html]:
+            in_degree[idx[link]] += 1
+
+    # Sparse transition matrix in CSR form: the sources linking to page j
+    # are indices[indptr[j]:indptr[j + 1]], weighted by the matching vals
+    indptr = [0, *accumulate(in_degree)]
+    indices = [0] * indptr[-1]
+    vals = [0.0] * indptr[-1]
+    cursor = indptr[:-1]
+    dangling = []
+    for i, html in enumerate(nodes):
+        links = corpus[html]
+        if not links:
+            dangling.append(i)
+            continue
+        weight = 1 / len(links)
+        for link in links:
+            j = idx[link]
+            k = cursor[j]
+            indices[k] = i
+            vals[k] = weight
+            cursor[j] = k + 1
+
+    # Sweep heavily linked-to pages first so their updates propagate sooner
+    order = sorted(range(N), key=in_degree.__getitem__, reverse=True)
+
+    # Ranks are a plain list indexed by page id; array.array('d') would
+    # box a new float on every read and makes the sweep slower
+    rank = [1 / N] * N
+    previous = [[0.0] * N, [0.0] * N]
+
+    # Each sweep shrinks the error by about damping_factor, so allow twice
+    # the sweeps needed to reach TOLERANCE, and never fewer than MAX_ITERATIONS
+    max_sweeps = MAX_ITERATIONS
+    if 0 < damping_factor < 1:
+        max_sweeps = max(max_sweeps, 2 * ceil(log(TOLERANCE) / log(damping_factor)))
+    errors = [0.0, 0.0, 0.0]
+    sweeps = 0
+    extrapolate = True
+    err_target = None
+
+    while sweeps < max_sweeps:
+        # A page with no links is treated as linking to every page, so the
+        # dangling pages' combined rank is one scalar shared by every row
+        dangle_sum = sum(map(rank.__getitem__, dangling))
+        base = (1 - damping_factor) / N + damping_factor * dangle_sum / N
+
+        err = pagerank_sweep(indptr, indices, vals, order, rank, base, damping_factor)
+        sweeps += 1
+        errors = [errors[1], errors[2], err]
+
+        # Converged once the L1 change is below TOLERANCE per page, the
+        # usual err < N * tol test, rather than bounding every change
+        if err < N * TOLERANCE:
+            break
+
+        if not extrapolate:
+            continue
 
-    for html in corpus:
-        rank[html] = 1 / N
-        link_to[html] = []
+        countdown = -sweeps % EXTRAPOLATE_EVERY
+
+        # A few sweeps after an extrapolation, check that it did at least as
+        # well as plain sweeps would have. If not, fall back to the iterate it
+        # replaced and carry on without extrapolating
+        if countdown == 2 and err_target is not None:
+            if err > err_target:
+                rank = previous[0]
+                extrapolate = False
+                continue
+            err_target = None
+
+        # Copy the two iterates preceding each Aitken extrapolation into
+        # reusable buffers rather than snapshotting rank every sweep
+        if countdown in (1, 2):
+            previous[2 - countdown][:] = rank
+        elif countdown == 0 and errors_settled(*errors):
+            extrapolated = aitken_extrapolate(previous[0], previous[1], rank)
+            previous[0][:] = rank
+            rank = extrapolated
+            err_target = err * (err / errors[1]) ** (EXTRAPOLATE_EVERY - 2)
+    else:
+        raise RuntimeError(
+            f"PageRank did not converge within {max_sweeps} iterations"
+        )
 
-    for html in corpus:
-        for link in corpus[html]:
-            link_to[link].append(html)
+    total = sum(rank)
+    return dict(zip(nodes, (value / total for value in rank)))
 
-    while True:
-        for html in corpus:
-            sum = 0
-            num_links_p = len(corpus[html])
-            for i in link_to[html]:
-                num_links_i = len(corpus[i])
-                sum += rank[i] / num_links_i
 
-            new[html] = ((1 - damping_factor) / N) + (damping_factor * sum)
+def pagerank_sweep(indptr, indices, vals, order, rank, base, damping_factor):
+    """
+    Run one Gauss-Seidel sweep of the PageRank update over a CSR inlink
+    matrix, visiting rows in `order` and updating `rank` in place so
+    later rows see the new values.
+
+    Return the L1 norm of the change made to the PageRank values.
+    """
+    err = 0
+    for j in order:
+        s = 0
+        for k in range(indptr[j], indptr[j + 1]):
+            s += rank[indices[k]] * vals[k]
+        new = base + damping_factor * s
+        err += abs(new - rank[j])
+        rank[j] = new
+
+    return err
+
+
+def errors_settled(e0, e1, e2):
+    """
+    Return True if three successive sweep errors `e0`, `e1`, `e2` are
+    shrinking by a steady ratio, which is when the error is dominated by
+    a single component and Aitken extrapolation can cancel it.
+    """
+    if e0 <= 0 or e1 <= 0 or e2 >= e1:
+        return False
+    ratio = e2 / e1
+    return abs(ratio - e1 / e0) <= RATIO_TOLERANCE * ratio
 
-        max_diff = 0
-        for html in rank:
-            diff = abs(rank[html] - new[html])
-            if diff > max_diff:
-                max_diff = diff
 
-        if max_diff < THRESHOLD:
-            return rank
+def aitken_extrapolate(r0, r1, r2):
+    """
+    Apply Aitken's delta-squared extrapolation to three successive
+    PageRank iterates `r0`, `r1`, `r2`, cancelling the slowest-decaying
+    error component.
+
+    Return the extrapolated ranks as a list normalised to sum to 1.
+    Components whose extrapolation is undefined or not positive keep
+    their value from `r2`.
+    """
+    extrap = []
+    total = 0
+    for a, b, c in zip(r0, r1, r2):
+        denom = c - 2 * b + a
+        value = c - (c - b) ** 2 / denom if denom != 0 else c
+        if value <= 0:
+            value = c
+        extrap.append(value)
+        total += value
+
+    return [value / total for value in extrap]
 
-        rank = new.copy()
 
 if __name__ == "__main__":
     main()